@@ -9,15 +9,47 @@ import sys
 import subprocess
 import re
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+
+from .prompt_cache import make_message
 
 model = os.getenv("LITELLM_MODEL", "openai/gpt-4o")
 
+FEEDBACK_TEMPLATE = (
+    "User feedback on the previous commit message: {feedback}\n"
+    "Please revise the commit message based on this feedback."
+)
+
+# Appended to a file diff in place of the lines that were cut
+TRUNCATION_MARKER = "[...truncated {count} lines for this file...]"
+
+# Key listing the files truncate_file_diffs had no room for
+OMITTED_FILES = "[omitted files]"
+
+# Files that mark a directory as the root of a package in a monorepo
+PACKAGE_MARKERS = ("pyproject.toml", "package.json")
+
+# Scope for changed files that are not inside any package
+ROOT_SCOPE = "."
+
+# Diff lines each package prompt may use, shared among the package's files
+PACKAGE_MAX_LINES = 500
+
 from git import Repo
 import sys, os
 
+def _truncate(file_diff, max_lines):
+    lines = file_diff.splitlines()
+    if len(lines) > max_lines:
+        return "\n".join(lines[:max_lines]) + "\n" + TRUNCATION_MARKER.format(count=len(lines) - max_lines)
+    return file_diff
+
 def get_file_diffs(diff_text, max_lines=100):
     """
     Returns a dict: {filename: diff_output (possibly truncated)}
+
+    Pass max_lines=None to keep every diff whole.
     """
     file_diffs = re.split(r'(?=^diff --git )', diff_text, flags=re.MULTILINE)
     result = {}
@@ -30,14 +62,53 @@ def get_file_diffs(diff_text, max_lines=100):
             filename = match.group(2)
         else:
             filename = 'unknown'
-        lines = file_diff.splitlines()
-        if len(lines) > max_lines:
-            truncated = "\n".join(lines[:max_lines]) + f"\n[...truncated {len(lines) - max_lines} lines for this file...]"
-            result[filename] = truncated
-        else:
-            result[filename] = file_diff
+        result[filename] = file_diff if max_lines is None else _truncate(file_diff, max_lines)
     return result
 
+def _fit_to_budget(file_diffs, max_lines):
+    remaining = max_lines
+    result = {}
+    omitted = []
+    by_size = sorted(file_diffs, key=lambda filename: len(file_diffs[filename].splitlines()))
+    for i, filename in enumerate(by_size):
+        share = remaining // (len(by_size) - i)
+        length = len(file_diffs[filename].splitlines())
+        if length <= share:
+            result[filename] = file_diffs[filename]
+            remaining -= length
+        elif share >= 2:
+            # One line of the share goes to the truncation marker
+            result[filename] = _truncate(file_diffs[filename], share - 1)
+            remaining -= share
+        else:
+            omitted.append(filename)
+    return result, omitted
+
+def truncate_file_diffs(file_diffs, max_lines):
+    """
+    Truncate file diffs so that together they fit in a budget of lines.
+
+    Diffs smaller than an even share of the budget are kept whole and the lines
+    they leave unused are shared among the larger ones. Truncation markers count
+    against the budget. Files that no longer get at least one line of diff are
+    left out and listed in a one-line OMITTED_FILES entry instead.
+
+    Args:
+        file_diffs (dict): Dictionary of file diffs
+        max_lines (int): Total number of diff lines to keep
+
+    Returns:
+        dict: Dictionary of file diffs, in the same order
+    """
+    result, omitted = _fit_to_budget(file_diffs, max_lines)
+    if omitted:
+        # Make room for the note listing the omitted files
+        result, omitted = _fit_to_budget(file_diffs, max_lines - 1)
+    truncated = {filename: result[filename] for filename in file_diffs if filename in result}
+    if omitted:
+        truncated[OMITTED_FILES] = f"[...{len(omitted)} more files omitted: {', '.join(omitted)}...]"
+    return truncated
+
 def smart_diff(repo_path=".", max_lines=100):
     repo = Repo(repo_path)
 
@@ -88,15 +159,46 @@ def get_previous_commit_messages(repo_path=".", num_commits=3):
     commits = list(repo.iter_commits(max_count=num_commits))
     return [commit.message.strip() for commit in commits]
 
-def generate_commit_msg(file_diffs, additional_prompt=None, include_previous_commits=True, feedback=None):
+def _commit_msg_instructions(previous_commits=None):
+    instructions = (
+        "You are a helpful assistant that generates a commit message for the current changes.\n"
+        "Only provide the commit message, no other text.\n"
+    )
+    if previous_commits:
+        instructions += "\nHere are some previous commit messages to follow the same style:\n"
+        for i, msg in enumerate(previous_commits, 1):
+            instructions += f"{i}. {msg}\n"
+    return instructions
+
+def _append_feedback_turns(messages, history):
+    history = history or []
+    for i, (commit_msg, feedback) in enumerate(history):
+        messages.append(make_message("assistant", commit_msg, model))
+        messages.append(make_message(
+            "user",
+            FEEDBACK_TEMPLATE.format(feedback=feedback),
+            model,
+            # Mark the latest turn so the next round can reuse the whole conversation
+            cache=i == len(history) - 1,
+        ))
+    return messages
+
+def build_commit_msg_messages(file_diffs, additional_prompt=None, previous_commits=None, history=None):
     """
-    Generate a commit message for the current changes.
-    
+    Build the chat messages for commit message generation.
+
+    The messages are ordered from most to least stable so that providers can reuse a
+    cached prefix: instructions and style exemplars first, then the diffs, then one
+    assistant/user turn pair per round of feedback.
+
     Args:
         file_diffs (dict): Dictionary of file diffs
         additional_prompt (str, optional): Additional sentences to add to the prompt
-        include_previous_commits (bool): Whether to include previous commit messages in the prompt
-        feedback (str, optional): User feedback to incorporate into the commit message
+        previous_commits (list, optional): Previous commit messages to use as style exemplars
+        history (list, optional): List of (commit_msg, feedback) tuples from earlier rounds
+
+    Returns:
+        list: Messages in the format expected by litellm.completion
     """
     # Format the file diffs in a way that is easier for the model to understand
     formatted_diffs = ""
@@ -104,67 +206,313 @@ def generate_commit_msg(file_diffs, additional_prompt=None, include_previous_com
         formatted_diffs += f"File: {filename}\n"
         formatted_diffs += f"```\n{diff}\n```\n"
 
-    prompt = f"""
-    You are a helpful assistant that generates a commit message for the current changes.
-    Only provide the commit message, no other text.
+    changes = f"The changes are described in the following diffs:\n{formatted_diffs}"
+    if additional_prompt:
+        changes += f"\nAdditional context: {additional_prompt}"
+
+    messages = [
+        make_message("system", _commit_msg_instructions(previous_commits), model, cache=True),
+        make_message("user", changes, model, cache=True),
+    ]
+    return _append_feedback_turns(messages, history)
 
-    The changes are described in the following diffs:
-    {formatted_diffs}
+def generate_commit_msg(file_diffs, additional_prompt=None, include_previous_commits=True, feedback=None, history=None):
     """
+    Generate a commit message for the current changes.
     
-    if include_previous_commits:
-        previous_commits = get_previous_commit_messages()
-        if previous_commits:
-            prompt += "\nHere are some previous commit messages to follow the same style:\n"
-            for i, msg in enumerate(previous_commits, 1):
-                prompt += f"{i}. {msg}\n"
-    
-    if additional_prompt:
-        prompt += f"\nAdditional context: {additional_prompt}"
-        
+    Args:
+        file_diffs (dict): Dictionary of file diffs
+        additional_prompt (str, optional): Additional sentences to add to the prompt
+        include_previous_commits (bool): Whether to include previous commit messages in the prompt
+        feedback (str, optional): User feedback to incorporate into the commit message
+        history (list, optional): List of (commit_msg, feedback) tuples from earlier rounds,
+            sent as follow-up turns so the cached prompt prefix is reused
+    """
+    previous_commits = get_previous_commit_messages() if include_previous_commits else None
+    messages = build_commit_msg_messages(
+        file_diffs,
+        additional_prompt=additional_prompt,
+        previous_commits=previous_commits,
+        history=history,
+    )
+
     if feedback:
-        prompt += f"\n\nUser feedback on the previous commit message: {feedback}\nPlease revise the commit message based on this feedback."
-        
-    response = litellm.completion(model=model, messages=[{"role": "user", "content": prompt}])
+        messages.append(make_message(
+            "user",
+            FEEDBACK_TEMPLATE.format(feedback=feedback),
+            model,
+        ))
+
+    response = litellm.completion(model=model, messages=messages)
     return response.choices[0].message.content
 
-def interactive_commit_msg(file_diffs, additional_prompt=None, include_previous_commits=True):
+def _matches_glob(directory, pattern):
+    # Match path components one by one so "*" never crosses a "/"
+    parts = directory.split("/")
+    pattern_parts = pattern.strip("/").split("/")
+    return len(parts) == len(pattern_parts) and all(
+        fnmatchcase(part, pattern_part) for part, pattern_part in zip(parts, pattern_parts)
+    )
+
+def group_file_diffs_by_package(file_diffs, repo_path=".", package_globs=None, markers=PACKAGE_MARKERS):
+    """
+    Group file diffs by the package each file belongs to.
+
+    A file belongs to its deepest ancestor directory that either matches one of
+    `package_globs` or contains one of the `markers` files, in the working tree or
+    in HEAD (so a package whose marker is being deleted is still recognised). Files
+    outside every package are grouped under ROOT_SCOPE.
+
+    Args:
+        file_diffs (dict): Dictionary of file diffs
+        repo_path (str): Path to the git repository
+        package_globs (list, optional): Globs of package directories, e.g. ["packages/*"]
+        markers (tuple): File names that mark a directory as a package root
+
+    Returns:
+        dict: {package_dir: {filename: diff}} in the order packages are first seen
+    """
+    repo = Repo(repo_path)
+    working_tree_dir = repo.working_tree_dir
+    try:
+        head_tree = repo.head.commit.tree
+    except ValueError:
+        # No commits yet
+        head_tree = None
+    package_globs = package_globs or []
+    is_package = {}
+
+    def has_marker(directory, marker):
+        if os.path.isfile(os.path.join(working_tree_dir, directory, marker)):
+            return True
+        if head_tree is None:
+            return False
+        try:
+            head_tree.join(f"{directory}/{marker}")
+            return True
+        except KeyError:
+            return False
+
+    def package_of(filename):
+        parts = filename.split("/")[:-1]
+        for i in range(len(parts), 0, -1):
+            directory = "/".join(parts[:i])
+            if directory not in is_package:
+                is_package[directory] = any(
+                    _matches_glob(directory, pattern) for pattern in package_globs
+                ) or any(has_marker(directory, marker) for marker in markers)
+            if is_package[directory]:
+                return directory
+        return ROOT_SCOPE
+
+    groups = {}
+    for filename, diff in file_diffs.items():
+        groups.setdefault(package_of(filename), {})[filename] = diff
+    return groups
+
+def generate_package_summaries(file_diffs, additional_prompt=None, repo_path=".", package_globs=None,
+                               markers=PACKAGE_MARKERS, max_workers=None, max_lines=PACKAGE_MAX_LINES):
+    """
+    Summarize the changes to each package with concurrent model calls.
+
+    Each package's diffs are truncated to their own budget of `max_lines` lines, so
+    the diffs should be passed in untruncated, e.g. from smart_diff(max_lines=None).
+
+    Args:
+        file_diffs (dict): Dictionary of file diffs
+        additional_prompt (str, optional): Additional sentences to add to each prompt
+        repo_path (str): Path to the git repository
+        package_globs (list, optional): Globs of package directories, e.g. ["packages/*"]
+        markers (tuple): File names that mark a directory as a package root
+        max_workers (int, optional): Maximum number of concurrent model calls, by default
+            one per package
+        max_lines (int): Diff lines each package prompt may use
+
+    Returns:
+        dict: {package_dir: summary} in the order packages are first seen, or an
+            empty dict when all changes are in a single package
+    """
+    groups = group_file_diffs_by_package(file_diffs, repo_path, package_globs, markers)
+    if len(groups) <= 1:
+        return {}
+
+    def summarize(scope, file_diffs):
+        prompt = f"These changes are limited to the `{scope}` package. Describe only this package."
+        if additional_prompt:
+            prompt += f"\n{additional_prompt}"
+        messages = build_commit_msg_messages(
+            truncate_file_diffs(file_diffs, max_lines), additional_prompt=prompt
+        )
+        response = litellm.completion(model=model, messages=messages)
+        return response.choices[0].message.content
+
+    # One call per package by default, so latency is that of the slowest package
+    workers = len(groups) if max_workers is None else min(len(groups), max_workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {scope: executor.submit(summarize, scope, diffs) for scope, diffs in groups.items()}
+        return {scope: future.result() for scope, future in futures.items()}
+
+def merge_package_summaries(summaries, additional_prompt=None, include_previous_commits=True, history=None):
+    """
+    Merge per-package summaries into one commit message with a section per package.
+
+    Only the summaries are sent, so the prompt stays small however large the diffs are.
+
+    Args:
+        summaries (dict): {package_dir: summary} from generate_package_summaries
+        additional_prompt (str, optional): Additional sentences to add to the prompt
+        include_previous_commits (bool): Whether to include previous commit messages in the prompt
+        history (list, optional): List of (commit_msg, feedback) tuples from earlier rounds
+
+    Returns:
+        str: The merged commit message
+    """
+    previous_commits = get_previous_commit_messages() if include_previous_commits else None
+
+    changes = "The changes span several packages. Here is a summary of the changes in each package:\n"
+    for scope, summary in summaries.items():
+        changes += f"\nPackage: {scope}\n{summary}\n"
+    changes += (
+        "\nWrite a single commit message with a short subject line covering all packages, "
+        "followed by one section per package headed by the package path."
+    )
+    if additional_prompt:
+        changes += f"\nAdditional context: {additional_prompt}"
+
+    messages = [
+        make_message("system", _commit_msg_instructions(previous_commits), model, cache=True),
+        make_message("user", changes, model, cache=True),
+    ]
+    _append_feedback_turns(messages, history)
+    response = litellm.completion(model=model, messages=messages)
+    return response.choices[0].message.content
+
+def generate_scoped_commit_msg(file_diffs, additional_prompt=None, include_previous_commits=True,
+                               history=None, summaries=None, repo_path=".", package_globs=None,
+                               markers=PACKAGE_MARKERS, max_workers=None, max_lines=PACKAGE_MAX_LINES):
+    """
+    Generate a commit message for changes spanning several packages.
+
+    Each package is summarized in its own prompt, concurrently, and the summaries are
+    then merged into one message. Changes within a single package fall back to
+    generate_commit_msg with the same per-package line budget.
+
+    Args:
+        file_diffs (dict): Dictionary of file diffs
+        additional_prompt (str, optional): Additional sentences to add to the prompt
+        include_previous_commits (bool): Whether to include previous commit messages in the prompt
+        history (list, optional): List of (commit_msg, feedback) tuples from earlier rounds
+        summaries (dict, optional): Result of generate_package_summaries from an earlier
+            round, so feedback rounds only re-run the merge
+        repo_path (str): Path to the git repository
+        package_globs (list, optional): Globs of package directories, e.g. ["packages/*"]
+        markers (tuple): File names that mark a directory as a package root
+        max_workers (int, optional): Maximum number of concurrent model calls, by default
+            one per package
+        max_lines (int): Diff lines each package prompt may use
+
+    Returns:
+        str: The commit message
+    """
+    if summaries is None:
+        summaries = generate_package_summaries(
+            file_diffs, additional_prompt, repo_path, package_globs, markers, max_workers, max_lines
+        )
+    if not summaries:
+        return generate_commit_msg(
+            truncate_file_diffs(file_diffs, max_lines), additional_prompt, include_previous_commits,
+            history=history
+        )
+    return merge_package_summaries(summaries, additional_prompt, include_previous_commits, history)
+
+def interactive_commit_msg(file_diffs, additional_prompt=None, include_previous_commits=True,
+                           split_packages=False, repo_path=".", package_globs=None,
+                           markers=PACKAGE_MARKERS, max_workers=None, max_lines=PACKAGE_MAX_LINES):
     """
     Interactively generate a commit message with user feedback.
+
+    Each round of feedback is sent as a follow-up turn after the previous answer, so
+    the instructions, exemplars and diffs form a prefix the provider can cache.
     
     Args:
         file_diffs (dict): Dictionary of file diffs
         additional_prompt (str, optional): Additional sentences to add to the prompt
         include_previous_commits (bool): Whether to include previous commit messages in the prompt
+        split_packages (bool): Summarize each package separately and merge the summaries
+        repo_path (str): Path to the git repository
+        package_globs (list, optional): Globs of package directories, e.g. ["packages/*"]
+        markers (tuple): File names that mark a directory as a package root
+        max_workers (int, optional): Maximum number of concurrent model calls, by default
+            one per package
+        max_lines (int): Diff lines each package prompt may use with split_packages
     
     Returns:
         str: The final accepted commit message
     """
-    feedback = None
-    while True:
-        commit_msg = generate_commit_msg(
-            file_diffs,
-            additional_prompt=additional_prompt,
-            include_previous_commits=include_previous_commits,
-            feedback=feedback
+    summaries = None
+    if split_packages:
+        # Summaries are generated once; feedback rounds only revise the merge
+        summaries = generate_package_summaries(
+            file_diffs, additional_prompt, repo_path, package_globs, markers, max_workers, max_lines
         )
+
+    history = []
+    while True:
+        if split_packages:
+            commit_msg = generate_scoped_commit_msg(
+                file_diffs,
+                additional_prompt=additional_prompt,
+                include_previous_commits=include_previous_commits,
+                history=history,
+                summaries=summaries,
+                max_lines=max_lines
+            )
+        else:
+            commit_msg = generate_commit_msg(
+                file_diffs,
+                additional_prompt=additional_prompt,
+                include_previous_commits=include_previous_commits,
+                history=history
+            )
         print("\nGenerated commit message:")
         print(commit_msg)
         user_feedback = input("\nPress Enter to accept, or type feedback to revise: ").strip()
         if not user_feedback:
             return commit_msg
-        feedback = user_feedback
+        history.append((commit_msg, user_feedback))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate a commit message for the current changes.")
     parser.add_argument("--prompt", "-p", type=str, help="Additional sentences to add to the prompt")
     parser.add_argument("--no-previous", action="store_true", 
                       help="Do NOT include previous commit messages in the prompt (default: include them)")
+    parser.add_argument("--split-packages", action="store_true",
+                      help="Summarize each package separately and merge the summaries into one message")
+    parser.add_argument("--package-root", action="append", metavar="GLOB",
+                      help="Glob of package directories, e.g. 'packages/*' (repeatable, implies --split-packages)")
+    parser.add_argument("--package-marker", action="append", metavar="FILE",
+                      help=f"File that marks a package root (repeatable, default: {', '.join(PACKAGE_MARKERS)})")
+    parser.add_argument("--workers", "-j", type=int,
+                      help="Maximum number of concurrent model calls with --split-packages "
+                      "(default: one per package)")
+    parser.add_argument("--package-max-lines", type=int, default=PACKAGE_MAX_LINES,
+                      help="Diff lines each package prompt may use with --split-packages")
     args = parser.parse_args()
     
-    file_diffs = smart_diff()
+    split_packages = args.split_packages or bool(args.package_root)
+    # With --split-packages, diffs are truncated per package after grouping
+    file_diffs = smart_diff(max_lines=None if split_packages else 100)
 
-    final_commit_msg = interactive_commit_msg(file_diffs, args.prompt, not args.no_previous)
+    final_commit_msg = interactive_commit_msg(
+        file_diffs,
+        args.prompt,
+        not args.no_previous,
+        split_packages=split_packages,
+        package_globs=args.package_root,
+        markers=tuple(args.package_marker or PACKAGE_MARKERS),
+        max_workers=args.workers,
+        max_lines=args.package_max_lines,
+    )
     print("\nFinal commit message:")
     print("-" * 100)
     print(final_commit_msg)
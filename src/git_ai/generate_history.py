@@ -0,0 +1,510 @@
+"""
+Generate commit messages or a changelog for a range of existing commits.
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import litellm
+from git import Repo
+
+from .generate_commit_msg import TRUNCATION_MARKER, build_commit_msg_messages, model
+from .prompt_cache import make_message
+
+# Markers around each commit header in the `git log` output
+COMMIT_START = "\x1e"
+COMMIT_END = "\x1f"
+
+# Same file name pattern as get_file_diffs
+DIFF_HEADER = re.compile(r"^diff --git a/(.*?) b/(.*?)$")
+
+CHANGELOG_INSTRUCTIONS = (
+    "You are a helpful assistant that writes changelog entries for a software release.\n"
+    "Group related changes under short headings such as Features, Fixes and Other, "
+    "and write one concise bullet per notable change.\n"
+    "Only provide the changelog, no other text.\n"
+)
+
+
+def parse_git_log(lines, max_lines=100):
+    """
+    Parse `git log -p` output produced with COMMIT_START/COMMIT_END markers.
+
+    Diffs are truncated while streaming, so at most `max_lines` lines per file are
+    kept in memory however large a commit is.
+
+    Args:
+        lines (iterable): Lines of output, e.g. a file object streaming from git
+        max_lines (int): Maximum number of diff lines to keep per file
+
+    Yields:
+        dict: {"sha": str, "message": str, "file_diffs": dict} for each commit
+    """
+    sha = None
+    header = []
+    # {filename: [kept lines, number of dropped lines]} for the current commit
+    files = {}
+    current = None
+    in_header = False
+
+    def build():
+        file_diffs = {}
+        for filename, (kept, dropped) in files.items():
+            file_diff = "".join(kept)
+            if dropped:
+                file_diff = file_diff.rstrip("\n") + "\n" + TRUNCATION_MARKER.format(count=dropped)
+            file_diffs[filename] = file_diff
+        return {
+            "sha": sha,
+            "message": "".join(header).strip(),
+            "file_diffs": file_diffs,
+        }
+
+    for line in lines:
+        if line.startswith(COMMIT_START):
+            if sha is not None:
+                yield build()
+            sha = line[len(COMMIT_START):].strip()
+            header, files, current = [], {}, None
+            in_header = True
+        elif in_header:
+            if COMMIT_END in line:
+                header.append(line[:line.index(COMMIT_END)])
+                in_header = False
+            else:
+                header.append(line)
+        elif sha is not None:
+            if line.startswith("diff --git "):
+                match = DIFF_HEADER.match(line)
+                current = files.setdefault(match.group(2) if match else "unknown", [[], 0])
+            elif current is None:
+                if not line.strip():
+                    continue
+                current = files.setdefault("unknown", [[], 0])
+            if len(current[0]) < max_lines:
+                current[0].append(line)
+            else:
+                current[1] += 1
+
+    if sha is not None:
+        yield build()
+
+
+def iter_commit_diffs(rev_range, repo_path=".", max_lines=100):
+    """
+    Stream the commits in a revision range, oldest first, with their parsed diffs.
+
+    Only one commit is held in memory at a time, with at most `max_lines` diff lines
+    per file.
+
+    Args:
+        rev_range (str): Revision range understood by `git log`, e.g. "v1.0..v2.0"
+        repo_path (str): Path to the git repository
+        max_lines (int): Maximum number of diff lines to keep per file
+
+    Yields:
+        dict: {"sha": str, "message": str, "file_diffs": dict} for each commit
+    """
+    # stderr goes to a file rather than a pipe, so git never blocks on a full stderr
+    # pipe while we are still reading stdout
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(
+            [
+                "git", "log", "-p", "--reverse", "--no-color",
+                f"--format={COMMIT_START}%H%n%B{COMMIT_END}",
+                rev_range, "--",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            text=True,
+            errors="replace",
+            cwd=repo_path,
+        )
+        finished = False
+        try:
+            yield from parse_git_log(proc.stdout, max_lines=max_lines)
+            finished = True
+        finally:
+            proc.stdout.close()
+            if not finished and proc.poll() is None:
+                proc.kill()
+            returncode = proc.wait()
+
+        # Only reached when the output was fully read. A stream stopped early leaves
+        # git killed or dead from SIGPIPE, which is not an error and never gets here.
+        if returncode not in (0, -signal.SIGPIPE):
+            stderr.seek(0)
+            error = stderr.read().decode("utf-8", errors="replace").strip()
+            raise ValueError(f"git log failed for range {rev_range!r}: {error}")
+
+
+class ResponseCache:
+    """
+    On-disk cache of model responses keyed by the model name and request messages.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, messages):
+        key = json.dumps({"model": model, "messages": messages}, sort_keys=True)
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.txt")
+
+    def get(self, messages):
+        try:
+            with open(self._path(messages), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, messages, content):
+        path = self._path(messages)
+        # Write then rename so concurrent workers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+def complete(messages, cache=None, completion=None):
+    """
+    Send messages to the model, using the response cache when one is given.
+
+    Args:
+        messages (list): Messages in the format expected by litellm.completion
+        cache (ResponseCache, optional): Cache of previous responses
+        completion (callable, optional): Backend to call instead of litellm.completion
+
+    Returns:
+        str: The content of the model response
+    """
+    if cache is not None:
+        content = cache.get(messages)
+        if content is not None:
+            return content
+    completion = completion or litellm.completion
+    response = completion(model=model, messages=messages)
+    content = response.choices[0].message.content
+    if cache is not None:
+        cache.put(messages, content)
+    return content
+
+
+def default_state_path(repo_path, rev_range):
+    """
+    Get the default checkpoint path for a revision range, inside the git directory.
+    """
+    state_dir = os.path.join(Repo(repo_path).git_dir, "git-ai")
+    os.makedirs(state_dir, exist_ok=True)
+    name = hashlib.sha256(rev_range.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(state_dir, f"history-{name}.jsonl")
+
+
+def load_checkpoint(checkpoint_path, additional_prompt=None):
+    """
+    Load the commits already processed by a previous run with the same settings.
+
+    Records generated by a different model or additional prompt are ignored, so
+    changing either regenerates the messages.
+
+    Args:
+        checkpoint_path (str): Path to the JSON lines checkpoint file
+        additional_prompt (str, optional): Additional prompt of the current run
+
+    Returns:
+        dict: {sha: record} for every completed commit
+    """
+    done = {}
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run interrupted mid-write leaves a partial last line
+                continue
+            if record.get("model") == model and record.get("prompt") == additional_prompt:
+                done[record["sha"]] = record
+    return done
+
+
+def open_checkpoint(checkpoint_path, resume=True):
+    """
+    Open the checkpoint file for appending new records.
+
+    Args:
+        checkpoint_path (str): Path to the JSON lines checkpoint file
+        resume (bool): Keep the existing records, otherwise start a new file
+
+    Returns:
+        file: The checkpoint file, opened for appending
+    """
+    if not resume:
+        return open(checkpoint_path, "w", encoding="utf-8")
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8")
+    partial = False
+    with open(checkpoint_path, "rb") as f:
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            partial = f.read(1) != b"\n"
+    if partial:
+        # Terminate the partial line of an interrupted run so the next record
+        # starts on its own line
+        checkpoint.write("\n")
+    return checkpoint
+
+
+def generate_history_messages(
+    rev_range,
+    repo_path=".",
+    checkpoint_path=None,
+    cache_dir=None,
+    max_workers=8,
+    max_lines=100,
+    additional_prompt=None,
+    resume=True,
+    completion=None,
+    on_record=None,
+):
+    """
+    Generate a new commit message for every commit in a revision range.
+
+    Model calls run concurrently with at most `max_workers * 2` commits in flight.
+    Each finished commit is appended to the checkpoint file, so an interrupted or
+    failed run with the same model and additional prompt resumes where it left off.
+
+    Args:
+        rev_range (str): Revision range understood by `git log`, e.g. "v1.0..v2.0"
+        repo_path (str): Path to the git repository
+        checkpoint_path (str, optional): JSON lines file recording finished commits
+        cache_dir (str, optional): Directory for the response cache, disabled if None
+        max_workers (int): Maximum number of concurrent model calls
+        max_lines (int): Maximum number of diff lines to keep per file
+        additional_prompt (str, optional): Additional sentences to add to the prompt
+        resume (bool): Reuse commits from the checkpoint, otherwise start over
+        completion (callable, optional): Backend to call instead of litellm.completion
+        on_record (callable, optional): Called with each record as soon as it is
+            available, in completion order, including records from the checkpoint
+
+    Returns:
+        list: {"sha", "original", "message", "model", "prompt"} dicts in commit order, oldest first
+    """
+    if checkpoint_path is None:
+        checkpoint_path = default_state_path(repo_path, rev_range)
+    cache = ResponseCache(cache_dir) if cache_dir else None
+    done = load_checkpoint(checkpoint_path, additional_prompt) if resume else {}
+    order = []
+
+    def generate(commit):
+        prompt = f"Original commit message: {commit['message']}"
+        if additional_prompt:
+            prompt += f"\n{additional_prompt}"
+        messages = build_commit_msg_messages(commit["file_diffs"], additional_prompt=prompt)
+        return complete(messages, cache=cache, completion=completion)
+
+    with open_checkpoint(checkpoint_path, resume) as checkpoint, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def record(commit, message):
+            entry = {
+                "sha": commit["sha"],
+                "original": commit["message"],
+                "message": message,
+                "model": model,
+                "prompt": additional_prompt,
+            }
+            checkpoint.write(json.dumps(entry) + "\n")
+            checkpoint.flush()
+            done[commit["sha"]] = entry
+
+            if on_record:
+                on_record(entry)
+
+        pending = {}
+        try:
+            for commit in iter_commit_diffs(rev_range, repo_path=repo_path, max_lines=max_lines):
+                order.append(commit["sha"])
+                if commit["sha"] in done:
+                    if on_record:
+                        on_record(done[commit["sha"]])
+                    continue
+                if not commit["file_diffs"]:
+                    # Merges and empty commits have no diff to describe
+                    record(commit, commit["message"])
+                    continue
+                pending[executor.submit(generate, commit)] = commit
+                if len(pending) >= max_workers * 2:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record(pending.pop(future), future.result())
+
+            for future in wait(pending).done:
+                record(pending.pop(future), future.result())
+        except BaseException:
+            # Checkpoint the calls that did finish before re-raising, they are paid for
+            for future in pending:
+                future.cancel()
+            for future in wait(pending).done:
+                if not future.cancelled() and future.exception() is None:
+                    record(pending[future], future.result())
+            raise
+
+    return [done[sha] for sha in order]
+
+
+def generate_changelog(
+    rev_range,
+    repo_path=".",
+    checkpoint_path=None,
+    cache_dir=None,
+    max_workers=8,
+    max_lines=100,
+    batch_size=100,
+    additional_prompt=None,
+    resume=True,
+    completion=None,
+    on_record=None,
+):
+    """
+    Generate a changelog for a revision range.
+
+    Each commit is first summarized with generate_history_messages, then the
+    summaries are condensed into changelog sections in batches of `batch_size`.
+    Sections are merged in rounds, `batch_size` at a time, until one changelog
+    remains, so no prompt grows with the size of the range.
+
+    Args:
+        rev_range (str): Revision range understood by `git log`, e.g. "v1.0..v2.0"
+        repo_path (str): Path to the git repository
+        checkpoint_path (str, optional): JSON lines file recording finished commits
+        cache_dir (str, optional): Directory for the response cache, disabled if None
+        max_workers (int): Maximum number of concurrent model calls
+        max_lines (int): Maximum number of diff lines to keep per file
+        batch_size (int): Number of commit summaries or sections per changelog request
+        additional_prompt (str, optional): Additional sentences to add to each prompt
+        resume (bool): Reuse commits from the checkpoint, otherwise start over
+        completion (callable, optional): Backend to call instead of litellm.completion
+        on_record (callable, optional): Called with each commit record as soon as it
+            is available
+
+    Returns:
+        str: The changelog
+    """
+    records = generate_history_messages(
+        rev_range,
+        repo_path=repo_path,
+        checkpoint_path=checkpoint_path,
+        cache_dir=cache_dir,
+        max_workers=max_workers,
+        max_lines=max_lines,
+        additional_prompt=additional_prompt,
+        resume=resume,
+        completion=completion,
+        on_record=on_record,
+    )
+    if not records:
+        return ""
+    cache = ResponseCache(cache_dir) if cache_dir else None
+
+    def summarize(text, intro):
+        messages = [
+            make_message("system", CHANGELOG_INSTRUCTIONS, model, cache=True),
+            make_message("user", f"{intro}\n{text}", model),
+        ]
+        if additional_prompt:
+            messages.append(make_message("user", f"Additional context: {additional_prompt}", model))
+        return complete(messages, cache=cache, completion=completion)
+
+    def batched(items):
+        # At least two per batch so every merge round shrinks the list
+        size = max(batch_size, 2)
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        sections = list(executor.map(
+            lambda batch: summarize(
+                "\n".join(f"- {r['message']}" for r in batch),
+                "Write changelog entries for the following commits:",
+            ),
+            batched(records),
+        ))
+        while len(sections) > 1:
+            sections = list(executor.map(
+                lambda batch: batch[0] if len(batch) == 1 else summarize(
+                    "\n\n".join(batch),
+                    "Merge the following partial changelogs into a single changelog:",
+                ),
+                batched(sections),
+            ))
+    return sections[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate commit messages or a changelog for a range of commits."
+    )
+    parser.add_argument("rev_range", help="Revision range, e.g. v1.0..v2.0")
+    parser.add_argument("--changelog", action="store_true",
+                      help="Summarize the range as a changelog instead of per-commit messages")
+    parser.add_argument("--checkpoint", type=str,
+                      help="Checkpoint file to resume from (default: inside the .git directory)")
+    parser.add_argument("--restart", action="store_true",
+                      help="Ignore the checkpoint and regenerate every commit "
+                      "(cached responses are still reused unless --no-cache)")
+    parser.add_argument("--cache-dir", type=str,
+                      help="Response cache directory (default: inside the .git directory)")
+    parser.add_argument("--no-cache", action="store_true", help="Do NOT cache model responses")
+    parser.add_argument("--workers", "-j", type=int, default=8,
+                      help="Maximum number of concurrent model calls")
+    parser.add_argument("--prompt", "-p", type=str, help="Additional sentences to add to the prompt")
+    args = parser.parse_args()
+
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = args.cache_dir or os.path.join(Repo(".").git_dir, "git-ai", "cache")
+
+    def print_record(record):
+        print(f"{record['sha']}")
+        print(record["message"])
+        print("-" * 100, flush=True)
+
+    progress = itertools.count(1)
+
+    def print_progress(record):
+        subject = record["message"].split("\n", 1)[0]
+        print(f"[{next(progress)}] {record['sha'][:12]} {subject}", file=sys.stderr, flush=True)
+
+    if args.changelog:
+        print(generate_changelog(
+            args.rev_range,
+            checkpoint_path=args.checkpoint,
+            cache_dir=cache_dir,
+            max_workers=args.workers,
+            additional_prompt=args.prompt,
+            resume=not args.restart,
+            on_record=print_progress,
+        ))
+    else:
+        # Records are printed as they finish, so they come out in completion order
+        generate_history_messages(
+            args.rev_range,
+            checkpoint_path=args.checkpoint,
+            cache_dir=cache_dir,
+            max_workers=args.workers,
+            additional_prompt=args.prompt,
+            resume=not args.restart,
+            on_record=print_record,
+        )
@@ -9,6 +9,8 @@ from dotenv import load_dotenv
 from github import Auth, Github
 from pydantic import BaseModel
 
+from .prompt_cache import make_message
+
 # Use the .env file located in the same directory as this script
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"), override=True)
 
@@ -45,36 +47,43 @@ def generate_pr_description(pr_url: str, additional_text: str = None) -> PRDescr
     # Get a mapping of PR files to their patch
     pr_contents = {pr_file.filename: pr_file.patch for pr_file in pr.get_files()}
 
-    # Create the prompt
-    prompt = f"""
+    # Create the prompt. The instructions and response format come first, then the
+    # PR contents, so regenerating the same PR can reuse the cached prefix.
+    instructions = """
     Given the following information for a GitHub Pull Request, write a description for the
     PR. The description should be clear, concise, and highlight the key changes made.
 
+    Please provide your response in the following JSON format:
+    {
+        "title": "The PR title",
+        "files": {
+            "filename1": "file contents",
+            "filename2": "file contents"
+        },
+        "description": "Your detailed PR description"
+    }
+    """
+
+    prompt = f"""
     Pull Request title: "{pr_title}"
 
     Pull Request contents (provided as a mapping of filename to change information):
     ```json
     {json.dumps(pr_contents, indent=2)}
     ```
-
-    Please provide your response in the following JSON format:
-    {{
-        "title": "The PR title",
-        "files": {{
-            "filename1": "file contents",
-            "filename2": "file contents"
-        }},
-        "description": "Your detailed PR description"
-    }}
     """
 
+    messages = [
+        make_message("system", instructions, model),
+        make_message("user", prompt, model, cache=True),
+    ]
     if additional_text:
-        prompt += additional_text
+        messages.append(make_message("user", additional_text, model))
 
     # Generate the description using LiteLLM
     response = litellm.completion(
         model=model,
-        messages=[{"role": "user", "content": prompt}]
+        messages=messages
     )
     
     try:
@@ -0,0 +1,52 @@
+"""
+Helpers for laying out prompts so providers can reuse a cached prefix.
+
+Prompts are split into segments ordered from most to least stable (instructions
+and style exemplars, then the diff, then any follow-up turns). Providers such as
+OpenAI cache a matching prefix automatically; providers that need explicit
+breakpoints get an ``ephemeral`` cache_control marker on the segments we expect
+to repeat.
+"""
+
+# Providers that only cache prompt prefixes marked with cache_control
+CACHE_HINT_PROVIDERS = {"anthropic", "bedrock", "bedrock_converse", "vertex_ai", "vertex_ai_beta"}
+
+
+def supports_cache_hints(model):
+    """
+    Check whether the model's provider accepts explicit cache_control markers.
+
+    Args:
+        model (str): LiteLLM model name, e.g. "anthropic/claude-3-5-sonnet-20240620"
+
+    Returns:
+        bool: True if cache_control markers should be attached to messages
+    """
+    provider, _, name = model.partition("/")
+    if not name:
+        # No provider prefix, fall back to recognising Claude model names
+        return model.startswith("claude")
+    return provider in CACHE_HINT_PROVIDERS
+
+
+def make_message(role, text, model, cache=False):
+    """
+    Build a chat message, attaching a cache breakpoint when requested and supported.
+
+    Args:
+        role (str): Message role ("system", "user" or "assistant")
+        text (str): Message text
+        model (str): LiteLLM model name the message will be sent to
+        cache (bool): Whether this message ends a segment worth caching
+
+    Returns:
+        dict: A message in the format expected by litellm.completion
+    """
+    if cache and supports_cache_hints(model):
+        return {
+            "role": role,
+            "content": [
+                {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+            ],
+        }
+    return {"role": role, "content": text}
@@ -1,9 +1,11 @@
 import os
 import pytest
 from git import Repo
-from git_ai.generate_commit_msg import smart_diff, generate_commit_msg, get_previous_commit_messages, interactive_commit_msg
+from git_ai.generate_commit_msg import smart_diff, generate_commit_msg, get_previous_commit_messages, interactive_commit_msg, build_commit_msg_messages
+from git_ai.generate_commit_msg import group_file_diffs_by_package, generate_scoped_commit_msg, truncate_file_diffs, OMITTED_FILES
 import tempfile
 import shutil
+import threading
 
 @pytest.fixture
 def temp_repo():
@@ -294,4 +296,260 @@ def test_interactive_commit_msg_with_feedback(mocker):
     result = interactive_commit_msg(file_diffs)
     assert result == "feat: update test.txt with more descriptive message"
     assert input_mock.call_count == 2
-    assert completion_mock.call_count == 2 
\ No newline at end of file
+    assert completion_mock.call_count == 2
+
+def test_build_commit_msg_messages_layout():
+    file_diffs = {
+        "test.txt": "diff --git a/test.txt b/test.txt\n@@ -1 +1 @@\n-initial content\n+modified content"
+    }
+    messages = build_commit_msg_messages(
+        file_diffs,
+        additional_prompt="Part of a refactor.",
+        previous_commits=["feat: add new feature"],
+        history=[("feat: update test.txt", "make it more descriptive")],
+    )
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    # Instructions and exemplars come before the diff
+    assert "feat: add new feature" in messages[0]["content"]
+    assert "modified content" not in messages[0]["content"]
+    assert "modified content" in messages[1]["content"]
+    assert "Part of a refactor." in messages[1]["content"]
+    assert messages[2]["content"] == "feat: update test.txt"
+    assert "make it more descriptive" in messages[3]["content"]
+
+def test_build_commit_msg_messages_prefix_stable_across_rounds():
+    file_diffs = {"test.txt": "diff --git a/test.txt b/test.txt\n+modified content"}
+    first = build_commit_msg_messages(file_diffs, previous_commits=["fix: resolve bug"])
+    second = build_commit_msg_messages(
+        file_diffs,
+        previous_commits=["fix: resolve bug"],
+        history=[("fix: update test.txt", "shorter")],
+    )
+    assert second[:len(first)] == first
+
+def test_build_commit_msg_messages_cache_hints(mocker):
+    mocker.patch('git_ai.generate_commit_msg.model', "anthropic/claude-3-5-sonnet-20240620")
+    file_diffs = {"test.txt": "diff --git a/test.txt b/test.txt\n+modified content"}
+    messages = build_commit_msg_messages(
+        file_diffs,
+        history=[("a", "first"), ("b", "second")],
+    )
+    cached = [
+        i for i, m in enumerate(messages)
+        if isinstance(m["content"], list) and "cache_control" in m["content"][0]
+    ]
+    # System prompt, diffs and the latest feedback turn are cache breakpoints
+    assert cached == [0, 1, 5]
+
+def test_interactive_commit_msg_sends_feedback_as_follow_up_turn(mocker):
+    file_diffs = {"test.txt": "diff --git a/test.txt b/test.txt\n+modified content"}
+    responses = [
+        type('Response', (), {'choices': [type('Choice', (), {
+            'message': type('Message', (), {'content': content})
+        })]})
+        for content in ["feat: update test.txt", "feat: update test.txt contents"]
+    ]
+    mocker.patch('builtins.input', mocker.MagicMock(side_effect=["be specific", ""]))
+    completion_mock = mocker.patch('litellm.completion', side_effect=responses)
+    interactive_commit_msg(file_diffs, include_previous_commits=False)
+    first = completion_mock.call_args_list[0].kwargs["messages"]
+    second = completion_mock.call_args_list[1].kwargs["messages"]
+    assert second[:len(first)] == first
+    assert second[len(first)] == {"role": "assistant", "content": "feat: update test.txt"}
+    assert "be specific" in second[-1]["content"]
+
+@pytest.fixture
+def monorepo(temp_repo):
+    """Add package roots to the temporary repository."""
+    for path in ["packages/api/pyproject.toml", "packages/web/package.json", "services/auth/README.md"]:
+        full_path = os.path.join(temp_repo, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as f:
+            f.write("")
+    return temp_repo
+
+def test_group_file_diffs_by_package(monorepo):
+    file_diffs = {
+        "packages/api/src/app.py": "api diff",
+        "packages/api/tests/test_app.py": "api test diff",
+        "packages/web/index.js": "web diff",
+        "services/auth/main.py": "auth diff",
+        "README.md": "root diff",
+    }
+    groups = group_file_diffs_by_package(file_diffs, repo_path=monorepo)
+    assert groups == {
+        "packages/api": {
+            "packages/api/src/app.py": "api diff",
+            "packages/api/tests/test_app.py": "api test diff",
+        },
+        "packages/web": {"packages/web/index.js": "web diff"},
+        ".": {"services/auth/main.py": "auth diff", "README.md": "root diff"},
+    }
+
+def test_group_file_diffs_by_package_globs(monorepo):
+    file_diffs = {
+        "services/auth/main.py": "auth diff",
+        "services/auth/lib/util.py": "util diff",
+        "packages/web/index.js": "web diff",
+    }
+    groups = group_file_diffs_by_package(file_diffs, repo_path=monorepo, package_globs=["services/*"], markers=())
+    assert list(groups) == ["services/auth", "."]
+    assert list(groups["services/auth"]) == ["services/auth/main.py", "services/auth/lib/util.py"]
+
+def _response(content):
+    return type('Response', (), {'choices': [type('Choice', (), {
+        'message': type('Message', (), {'content': content})
+    })]})
+
+def test_generate_scoped_commit_msg(mocker, monorepo):
+    file_diffs = {
+        "packages/api/src/app.py": "api diff",
+        "packages/web/index.js": "web diff",
+    }
+
+    def completion(model, messages):
+        text = messages[1]["content"]
+        if text.startswith("The changes span several packages"):
+            return _response("feat: update api and web\n\n" + text)
+        return _response("summary of " + text.split("File: ")[1].splitlines()[0])
+
+    completion_mock = mocker.patch('litellm.completion', side_effect=completion)
+    commit_msg = generate_scoped_commit_msg(file_diffs, include_previous_commits=False, repo_path=monorepo)
+    # One call per package and one to merge the summaries
+    assert completion_mock.call_count == 3
+    assert "Package: packages/api\nsummary of packages/api/src/app.py" in commit_msg
+    assert "Package: packages/web\nsummary of packages/web/index.js" in commit_msg
+    for call in completion_mock.call_args_list[:2]:
+        assert len([line for line in call.kwargs["messages"][1]["content"].splitlines() if line.startswith("File: ")]) == 1
+
+def test_generate_scoped_commit_msg_single_package(mocker, monorepo):
+    file_diffs = {"packages/api/src/app.py": "api diff"}
+    completion_mock = mocker.patch('litellm.completion', return_value=_response("feat: update api"))
+    commit_msg = generate_scoped_commit_msg(file_diffs, include_previous_commits=False, repo_path=monorepo)
+    assert completion_mock.call_count == 1
+    assert commit_msg == "feat: update api"
+
+def test_interactive_commit_msg_split_packages_revises_merge_only(mocker, monorepo):
+    file_diffs = {
+        "packages/api/src/app.py": "api diff",
+        "packages/web/index.js": "web diff",
+    }
+    mocker.patch('builtins.input', mocker.MagicMock(side_effect=["shorter", ""]))
+
+    def completion(model, messages):
+        text = messages[1]["content"]
+        if text.startswith("The changes span several packages"):
+            if len(messages) > 2:
+                return _response("feat: merged")
+            return _response("feat: long merged message")
+        if "packages/api/src/app.py" in text:
+            return _response("api summary")
+        return _response("web summary")
+
+    completion_mock = mocker.patch('litellm.completion', side_effect=completion)
+    result = interactive_commit_msg(
+        file_diffs, include_previous_commits=False, split_packages=True, repo_path=monorepo, max_workers=2
+    )
+    assert result == "feat: merged"
+    assert completion_mock.call_count == 4
+    merge_messages = completion_mock.call_args_list[-1].kwargs["messages"]
+    assert "Package: packages/api\napi summary" in merge_messages[1]["content"]
+    assert "Package: packages/web\nweb summary" in merge_messages[1]["content"]
+    assert "shorter" in merge_messages[-1]["content"]
+
+def test_interactive_commit_msg_split_packages_single_package(mocker, monorepo):
+    file_diffs = {"packages/api/src/app.py": "api diff"}
+    mocker.patch('builtins.input', mocker.MagicMock(side_effect=["shorter", ""]))
+    completion_mock = mocker.patch('litellm.completion', side_effect=[
+        _response("feat: update api app"), _response("feat: update api"),
+    ])
+    result = interactive_commit_msg(
+        file_diffs, include_previous_commits=False, split_packages=True, repo_path=monorepo
+    )
+    assert result == "feat: update api"
+    messages = completion_mock.call_args_list[-1].kwargs["messages"]
+    assert "api diff" in messages[1]["content"]
+    assert "shorter" in messages[-1]["content"]
+
+def test_truncate_file_diffs_shares_budget():
+    file_diffs = {
+        "small.txt": "\n".join(f"small {i}" for i in range(10)),
+        "large1.txt": "\n".join(f"large1 {i}" for i in range(1000)),
+        "large2.txt": "\n".join(f"large2 {i}" for i in range(1000)),
+    }
+    truncated = truncate_file_diffs(file_diffs, 300)
+    assert list(truncated) == ["small.txt", "large1.txt", "large2.txt"]
+    assert truncated["small.txt"] == file_diffs["small.txt"]
+    # The lines the small file leaves unused go to the large ones, markers included
+    assert "large1 143" in truncated["large1.txt"]
+    assert "large1 144" not in truncated["large1.txt"]
+    assert "[...truncated 856 lines for this file...]" in truncated["large2.txt"]
+    assert sum(len(diff.splitlines()) for diff in truncated.values()) == 300
+
+def test_truncate_file_diffs_more_files_than_budget():
+    file_diffs = {f"file{i}.txt": f"line 1 of {i}\nline 2 of {i}\nline 3 of {i}" for i in range(10)}
+    truncated = truncate_file_diffs(file_diffs, 9)
+    assert sum(len(diff.splitlines()) for diff in truncated.values()) <= 9
+    assert list(truncated)[-1] == OMITTED_FILES
+    shown = [filename for filename in truncated if filename != OMITTED_FILES]
+    omitted = [filename for filename in file_diffs if filename not in shown]
+    assert truncated[OMITTED_FILES] == f"[...{len(omitted)} more files omitted: {', '.join(omitted)}...]"
+
+def test_smart_diff_without_truncation(temp_repo):
+    test_file = os.path.join(temp_repo, "test.txt")
+    with open(test_file, "w") as f:
+        f.write("\n".join(f"line {i}" for i in range(300)))
+    diffs = smart_diff(temp_repo, max_lines=None)
+    assert "line 299" in diffs["test.txt"]
+    assert "truncated" not in diffs["test.txt"]
+
+def test_generate_scoped_commit_msg_truncates_per_package(mocker, monorepo):
+    file_diffs = {
+        "packages/api/src/app.py": "\n".join(f"api {i}" for i in range(1000)),
+        "packages/web/index.js": "\n".join(f"web {i}" for i in range(1000)),
+    }
+
+    def completion(model, messages):
+        return _response("summary")
+
+    completion_mock = mocker.patch('litellm.completion', side_effect=completion)
+    generate_scoped_commit_msg(file_diffs, include_previous_commits=False, repo_path=monorepo, max_lines=300)
+    prompts = [call.kwargs["messages"][1]["content"] for call in completion_mock.call_args_list[:2]]
+    for prompt in prompts:
+        # Each package gets the whole budget, not a global per-file cut
+        assert any(f"{name} 298" in prompt for name in ["api", "web"])
+        assert not any(f"{name} 299" in prompt for name in ["api", "web"])
+
+def test_group_file_diffs_by_package_marker_deleted(temp_repo):
+    repo = Repo(temp_repo)
+    marker = os.path.join(temp_repo, "packages/old/pyproject.toml")
+    os.makedirs(os.path.dirname(marker))
+    with open(marker, "w") as f:
+        f.write("")
+    repo.index.add([marker])
+    repo.index.commit("add old package")
+    os.remove(marker)
+
+    file_diffs = {
+        "packages/old/pyproject.toml": "marker deleted",
+        "packages/old/src/main.py": "main deleted",
+    }
+    groups = group_file_diffs_by_package(file_diffs, repo_path=temp_repo)
+    assert list(groups) == ["packages/old"]
+
+def test_generate_scoped_commit_msg_one_worker_per_package(mocker, temp_repo):
+    file_diffs = {f"packages/pkg{i}/main.py": f"pkg{i} diff" for i in range(12)}
+    # Every package summary has to be in flight at once to get past the barrier
+    barrier = threading.Barrier(12, timeout=10)
+
+    def completion(model, messages):
+        if messages[1]["content"].startswith("The changes span several packages"):
+            return _response("feat: update all packages")
+        barrier.wait()
+        return _response("summary")
+
+    mocker.patch('litellm.completion', side_effect=completion)
+    commit_msg = generate_scoped_commit_msg(
+        file_diffs, include_previous_commits=False, repo_path=temp_repo, package_globs=["packages/*"]
+    )
+    assert commit_msg == "feat: update all packages"
@@ -0,0 +1,326 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import pytest
+from git import Repo
+from git_ai.generate_commit_msg import get_file_diffs
+from git_ai.generate_history import (
+    generate_changelog,
+    generate_history_messages,
+    iter_commit_diffs,
+    parse_git_log,
+)
+
+@pytest.fixture
+def history_repo():
+    """Create a temporary git repository with a short history."""
+    temp_dir = tempfile.mkdtemp()
+    repo = Repo.init(temp_dir)
+    repo.config_writer().set_value("user", "name", "Test").release()
+    repo.config_writer().set_value("user", "email", "test@example.com").release()
+
+    for i in range(6):
+        test_file = os.path.join(temp_dir, f"file{i}.txt")
+        with open(test_file, "w") as f:
+            f.write(f"content {i}\n")
+        repo.index.add([test_file])
+        repo.index.commit(f"wip {i}")
+
+    yield temp_dir
+
+    shutil.rmtree(temp_dir)
+
+class FakeBackend:
+    """Stand-in for litellm.completion that echoes the files in the prompt."""
+
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, model, messages):
+        with self.lock:
+            self.calls += 1
+        text = messages[1]["content"]
+        if "Write changelog entries" in text or "Merge the following" in text:
+            content = f"changelog of {text.count('- ')} entries"
+        else:
+            files = sorted(line[len("File: "):] for line in text.splitlines() if line.startswith("File: "))
+            content = "Add " + ", ".join(files)
+        return type('Response', (), {
+            'choices': [type('Choice', (), {
+                'message': type('Message', (), {'content': content})
+            })]
+        })
+
+def test_parse_git_log():
+    lines = [
+        "\x1eabc123\n",
+        "Add feature\n",
+        "\n",
+        "Longer body\n",
+        "\x1f\n",
+        "diff --git a/a.txt b/a.txt\n",
+        "+hello\n",
+        "\x1edef456\n",
+        "Empty commit\n",
+        "\x1f\n",
+    ]
+    commits = list(parse_git_log(lines))
+    assert [c["sha"] for c in commits] == ["abc123", "def456"]
+    assert commits[0]["message"] == "Add feature\n\nLonger body"
+    assert list(commits[0]["file_diffs"]) == ["a.txt"]
+    assert "+hello" in commits[0]["file_diffs"]["a.txt"]
+    assert commits[1]["file_diffs"] == {}
+
+def test_parse_git_log_matches_get_file_diffs():
+    diff = (
+        "diff --git a/a.txt b/a.txt\n"
+        + "".join(f"+a {i}\n" for i in range(150))
+        + "diff --git a/b.txt b/b.txt\n"
+        + "+b\n"
+    )
+    lines = ["\x1eabc123\n", "Add files\n", "\x1f\n", "\n"] + diff.splitlines(keepends=True)
+    commit = next(parse_git_log(lines, max_lines=100))
+    assert commit["file_diffs"] == get_file_diffs(diff, max_lines=100)
+    assert commit["file_diffs"]["a.txt"].endswith("+a 98\n[...truncated 51 lines for this file...]")
+
+def test_parse_git_log_truncates_while_streaming():
+    def lines():
+        yield "\x1eabc123\n"
+        yield "Initial import\n"
+        yield "\x1f\n"
+        yield "diff --git a/big.txt b/big.txt\n"
+        for i in range(100000):
+            yield f"+line {i}\n"
+
+    commit = next(parse_git_log(lines(), max_lines=10))
+    assert len(commit["file_diffs"]["big.txt"].splitlines()) == 11
+    assert "[...truncated 99991 lines for this file...]" in commit["file_diffs"]["big.txt"]
+
+def test_iter_commit_diffs_range(history_repo):
+    repo = Repo(history_repo)
+    base = list(repo.iter_commits())[-2].hexsha  # second commit
+    commits = list(iter_commit_diffs(f"{base}..HEAD", repo_path=history_repo))
+    assert [c["message"] for c in commits] == ["wip 2", "wip 3", "wip 4", "wip 5"]
+    assert list(commits[0]["file_diffs"]) == ["file2.txt"]
+
+def test_iter_commit_diffs_invalid_range(history_repo):
+    with pytest.raises(ValueError, match="git log failed.*nope"):
+        list(iter_commit_diffs("nope..HEAD", repo_path=history_repo))
+
+def test_generate_history_messages(history_repo, tmp_path):
+    backend = FakeBackend()
+    records = generate_history_messages(
+        "HEAD~5..HEAD",
+        repo_path=history_repo,
+        checkpoint_path=str(tmp_path / "checkpoint.jsonl"),
+        max_workers=2,
+        completion=backend,
+    )
+    assert [r["original"] for r in records] == [f"wip {i}" for i in range(1, 6)]
+    assert [r["message"] for r in records] == [f"Add file{i}.txt" for i in range(1, 6)]
+    assert backend.calls == 5
+
+def test_generate_history_messages_resumes_from_checkpoint(history_repo, tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    generate_history_messages(
+        "HEAD~3..HEAD", repo_path=history_repo, checkpoint_path=checkpoint_path,
+        completion=FakeBackend(),
+    )
+    backend = FakeBackend()
+    records = generate_history_messages(
+        "HEAD~5..HEAD", repo_path=history_repo, checkpoint_path=checkpoint_path,
+        completion=backend,
+    )
+    # Only the two commits missing from the checkpoint are generated
+    assert backend.calls == 2
+    assert len(records) == 5
+
+def test_generate_history_messages_uses_response_cache(history_repo, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    generate_history_messages(
+        "HEAD~5..HEAD", repo_path=history_repo,
+        checkpoint_path=str(tmp_path / "first.jsonl"), cache_dir=cache_dir,
+        completion=FakeBackend(),
+    )
+    backend = FakeBackend()
+    records = generate_history_messages(
+        "HEAD~5..HEAD", repo_path=history_repo,
+        checkpoint_path=str(tmp_path / "second.jsonl"), cache_dir=cache_dir,
+        completion=backend,
+    )
+    assert backend.calls == 0
+    assert records[0]["message"] == "Add file1.txt"
+
+def test_generate_changelog_in_batches(history_repo, tmp_path):
+    backend = FakeBackend()
+    changelog = generate_changelog(
+        "HEAD~5..HEAD",
+        repo_path=history_repo,
+        checkpoint_path=str(tmp_path / "checkpoint.jsonl"),
+        batch_size=2,
+        completion=backend,
+    )
+    # 5 commit messages, 3 batches, then merges of 3 -> 2 -> 1 sections
+    assert backend.calls == 5 + 3 + 2
+    assert changelog.startswith("changelog of")
+
+def test_iter_commit_diffs_stopped_early(history_repo, mocker):
+    repo = Repo(history_repo)
+    # Large diffs so git is still writing when the stream is closed
+    for i in range(10):
+        big_file = os.path.join(history_repo, f"big{i}.txt")
+        with open(big_file, "w") as f:
+            f.write("line\n" * 20000)
+        repo.index.add([big_file])
+        repo.index.commit(f"big {i}")
+
+    popen = subprocess.Popen
+
+    def sigpipe_popen(*args, **kwargs):
+        # Let git run into the closed pipe before its exit status is checked
+        proc = popen(*args, **kwargs)
+        close = proc.stdout.close
+        def close_and_wait():
+            close()
+            proc.wait(timeout=30)
+        proc.stdout.close = close_and_wait
+        return proc
+
+    mocker.patch("git_ai.generate_history.subprocess.Popen", side_effect=sigpipe_popen)
+    commits = iter_commit_diffs("HEAD~12..HEAD", repo_path=history_repo)
+    assert next(commits)["message"] == "wip 4"
+    commits.close()
+
+def test_generate_history_messages_ignores_checkpoint_from_other_prompt(history_repo, tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    generate_history_messages(
+        "HEAD~3..HEAD", repo_path=history_repo, checkpoint_path=checkpoint_path,
+        completion=FakeBackend(),
+    )
+    backend = FakeBackend()
+    generate_history_messages(
+        "HEAD~3..HEAD", repo_path=history_repo, checkpoint_path=checkpoint_path,
+        additional_prompt="Use conventional commits.", completion=backend,
+    )
+    assert backend.calls == 3
+
+def test_generate_history_messages_restart(history_repo, tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    generate_history_messages(
+        "HEAD~3..HEAD", repo_path=history_repo, checkpoint_path=checkpoint_path,
+        completion=FakeBackend(),
+    )
+    backend = FakeBackend()
+    generate_history_messages(
+        "HEAD~3..HEAD", repo_path=history_repo, checkpoint_path=checkpoint_path,
+        resume=False, completion=backend,
+    )
+    assert backend.calls == 3
+
+def test_generate_history_messages_after_partial_checkpoint_line(history_repo, tmp_path):
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    generate_history_messages(
+        "HEAD~2..HEAD", repo_path=history_repo, checkpoint_path=str(checkpoint_path),
+        completion=FakeBackend(),
+    )
+    # Simulate a run interrupted while writing a record
+    with open(checkpoint_path, "a") as f:
+        f.write('{"sha": "abc')
+    generate_history_messages(
+        "HEAD~4..HEAD", repo_path=history_repo, checkpoint_path=str(checkpoint_path),
+        completion=FakeBackend(),
+    )
+    backend = FakeBackend()
+    records = generate_history_messages(
+        "HEAD~4..HEAD", repo_path=history_repo, checkpoint_path=str(checkpoint_path),
+        completion=backend,
+    )
+    assert backend.calls == 0
+    assert len(records) == 4
+
+def test_iter_commit_diffs_with_noisy_stderr(history_repo, mocker):
+    popen = subprocess.Popen
+
+    def noisy_popen(args, **kwargs):
+        # Write well over a pipe buffer of warnings to stderr before the log output
+        script = "import sys, subprocess; sys.stderr.write('warning\\n' * 50000); sys.stderr.flush(); " \
+                 "sys.exit(subprocess.call(sys.argv[1:]))"
+        return popen([sys.executable, "-c", script, *args], **kwargs)
+
+    mocker.patch("git_ai.generate_history.subprocess.Popen", side_effect=noisy_popen)
+    commits = list(iter_commit_diffs("HEAD~5..HEAD", repo_path=history_repo))
+    assert len(commits) == 5
+
+def test_generate_changelog_merges_in_rounds(history_repo, tmp_path):
+    repo = Repo(history_repo)
+    for i in range(6, 12):
+        test_file = os.path.join(history_repo, f"file{i}.txt")
+        with open(test_file, "w") as f:
+            f.write(f"content {i}\n")
+        repo.index.add([test_file])
+        repo.index.commit(f"wip {i}")
+
+    backend = FakeBackend()
+    merge_sizes = []
+    original_call = backend.__call__
+
+    def completion(model, messages):
+        text = messages[1]["content"]
+        if text.startswith("Merge the following"):
+            merge_sizes.append(text.count("changelog of"))
+        return original_call(model, messages)
+
+    changelog = generate_changelog(
+        "HEAD~11..HEAD",
+        repo_path=history_repo,
+        checkpoint_path=str(tmp_path / "checkpoint.jsonl"),
+        batch_size=2,
+        completion=completion,
+    )
+    # 11 commits make 6 sections, merged 6 -> 3 -> 2 -> 1, never more than 2 at once
+    assert merge_sizes == [2] * 5
+    assert backend.calls == 11 + 6 + 5
+    assert changelog.startswith("changelog of")
+
+def test_generate_history_messages_checkpoints_finished_calls_on_failure(history_repo, tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    backend = FakeBackend()
+
+    def failing_completion(model, messages):
+        if "file3.txt" in messages[1]["content"]:
+            raise RuntimeError("rate limited")
+        return backend(model, messages)
+
+    with pytest.raises(RuntimeError, match="rate limited"):
+        generate_history_messages(
+            "HEAD~5..HEAD", repo_path=history_repo, checkpoint_path=checkpoint_path,
+            max_workers=4, completion=failing_completion,
+        )
+    # Every other commit was in flight together and is kept
+    assert backend.calls == 4
+
+    resumed = FakeBackend()
+    generate_history_messages(
+        "HEAD~5..HEAD", repo_path=history_repo, checkpoint_path=checkpoint_path,
+        completion=resumed,
+    )
+    assert resumed.calls == 1
+
+def test_generate_history_messages_reports_records(history_repo, tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    generate_history_messages(
+        "HEAD~2..HEAD", repo_path=history_repo, checkpoint_path=checkpoint_path,
+        completion=FakeBackend(),
+    )
+    reported = []
+    records = generate_history_messages(
+        "HEAD~5..HEAD", repo_path=history_repo, checkpoint_path=checkpoint_path,
+        completion=FakeBackend(), on_record=reported.append,
+    )
+    # New and checkpointed records are all reported
+    assert sorted(r["sha"] for r in reported) == sorted(r["sha"] for r in records)
@@ -62,4 +62,27 @@ def test_invalid_pr_url(mocker):
 def test_missing_github_token(mocker):
     mocker.patch.dict('os.environ', {}, clear=True)
     with pytest.raises(ValueError, match="GH_ACCESS_TOKEN is not set"):
-        generate_pr_description("https://github.com/org/repo/pull/123") 
\ No newline at end of file
+        generate_pr_description("https://github.com/org/repo/pull/123") 
+def test_generate_pr_description_message_layout(mocker, mock_pr, mock_repo, mock_github):
+    mocker.patch.dict('os.environ', {"GH_ACCESS_TOKEN": "dummy"})
+    mocker.patch('git_ai.generate_pr_description.model', "anthropic/claude-3-5-sonnet-20240620")
+    mock_repo.get_pull.return_value = mock_pr
+    mock_github.return_value.get_repo.return_value = mock_repo
+
+    mock_litellm = mocker.patch('git_ai.generate_pr_description.litellm')
+    mock_response = mocker.Mock()
+    mock_response.choices = [mocker.Mock(message=mocker.Mock(content="Not JSON"))]
+    mock_litellm.completion.return_value = mock_response
+
+    generate_pr_description("https://github.com/org/repo/pull/123", "Mention the ticket.")
+
+    messages = mock_litellm.completion.call_args.kwargs["messages"]
+    assert [m["role"] for m in messages] == ["system", "user", "user"]
+    # Instructions first, too short to be worth a cache marker of their own
+    assert "JSON format" in messages[0]["content"]
+    # The PR contents end the cached prefix, additional text comes after it
+    contents = messages[1]["content"][0]
+    assert contents["cache_control"] == {"type": "ephemeral"}
+    assert "Add new feature" in contents["text"]
+    assert "+def test():" in contents["text"]
+    assert messages[2]["content"] == "Mention the ticket."
@@ -0,0 +1,22 @@
+from git_ai.prompt_cache import make_message, supports_cache_hints
+
+def test_supports_cache_hints():
+    assert supports_cache_hints("anthropic/claude-3-5-sonnet-20240620")
+    assert supports_cache_hints("bedrock/anthropic.claude-3-5-sonnet-20240620-v1:0")
+    assert supports_cache_hints("claude-3-5-sonnet-20240620")
+    # OpenAI caches matching prefixes automatically, no markers needed
+    assert not supports_cache_hints("openai/gpt-4o")
+    assert not supports_cache_hints("gpt-4o")
+
+def test_make_message_with_cache_hint():
+    message = make_message("system", "instructions", "anthropic/claude-3-5-sonnet-20240620", cache=True)
+    assert message == {
+        "role": "system",
+        "content": [
+            {"type": "text", "text": "instructions", "cache_control": {"type": "ephemeral"}}
+        ],
+    }
+
+def test_make_message_without_cache_hint():
+    assert make_message("user", "diff", "openai/gpt-4o", cache=True) == {"role": "user", "content": "diff"}
+    assert make_message("user", "diff", "anthropic/claude-3-5-sonnet-20240620") == {"role": "user", "content": "diff"}